@@ -1,91 +1,299 @@
-from typing import Optional, List
-import os
+from typing import Optional, List, Dict, FrozenSet, Tuple
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+import httpx
 import jwt
-from jwt import PyJWKClient
+import orjson
+from cachetools import TTLCache
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from jwt import PyJWK
+from jwt.utils import base64url_decode
 from fastapi import Depends
 from fastapi.security import SecurityScopes, HTTPAuthorizationCredentials, HTTPBearer
 
+from app.config import get_settings
 from app.exceptions import UnauthenticatedException, UnauthorizedException
 
-jwks_url = f"https://api.descope.com/{os.getenv('DESCOPE_PROJECT_ID')}/.well-known/jwks.json"
+logger = logging.getLogger(__name__)
+
+# Some CDNs or API gateways (like the one serving Descope's JWKS) may block requests without a
+# browser-like User-Agent, as they resemble bot traffic or security scanners.
+jwks_user_agent = "Mozilla/5.0 (DescopeFastAPISampleApp)"
+
+# Shared bearer scheme. auto_error=False lets a missing token reach __call__, which raises
+# UnauthenticatedException (401) instead of FastAPI's generic 403.
+_bearer = HTTPBearer(auto_error=False)
 
 class TokenVerifier:
-    def __init__(self):
-        try:
-            self.jwks_client = PyJWKClient(jwks_url)
-        except Exception:
-            # Fallback for deployment scenarios
-            self.jwks_client = None
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        self.config = get_settings()
+        self.jwks_url = self.config.jwks_url
+        # Reuse the application's pooled client when given one; otherwise own a private client
+        self._owns_http_client = http_client is None
+        self.jwks_http = http_client or httpx.AsyncClient(timeout=10.0)
         self.allowed_algorithms = ["RS256"]
+        # Claim checks use these directly: O(1) issuer membership, no Settings lookups per request
+        self._issuers = frozenset(self.config.issuer_candidates)
+        self._audience = self.config.audience
+        # RSA public keys by kid from the last JWKS response, trusted until _jwks_expires_at.
+        # Once stale, the JWKS is revalidated with a conditional GET (ETag / Last-Modified).
+        self._signing_keys: Dict[str, RSAPublicKey] = {}
+        self._jwks_ttl = 900
+        self._jwks_expires_at = 0.0
+        # While the keys are fresh, an unknown kid forces at most one refetch per interval,
+        # so tokens with made-up kids can't turn every request into a JWKS call
+        self._jwks_min_refresh_interval = 10
+        self._jwks_fetched_at: Optional[float] = None
+        self._jwks_etag: Optional[str] = None
+        # After a failed fetch, requests within the backoff reuse the outcome (the last good keys,
+        # or the failure) instead of each queueing up behind the lock for a request of their own
+        self._jwks_retry_backoff = 5
+        self._jwks_failed_at: Optional[float] = None
+        self._jwks_last_modified: Optional[str] = None
+        # Single-flight guard: concurrent cache misses share one JWKS request
+        self._jwks_lock = asyncio.Lock()
+        # Verified payloads keyed by a compact BLAKE2b digest of the raw token (never the token itself),
+        # so repeated calls from the same session skip signature verification until the entry expires.
+        self._payload_cache = TTLCache(maxsize=self.config.token_cache_size, ttl=self.config.token_cache_ttl)
+        self._payload_cache_lock = threading.Lock()
 
     async def __call__(
         self,
         security_scopes: SecurityScopes,
-        token: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer())
+        token: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)
     ):
         if token is None:
             raise UnauthenticatedException
 
         token = token.credentials
 
-        # For deployment testing, return a mock response if JWT verification fails
         try:
-            key = self._get_signing_key(token)
-            payload = self._decode_token(token, key)
+            cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+            # Cache hits are resolved synchronously; only a miss awaits the JWKS and verification
+            entry = self._get_cached_payload(cache_key)
+            if entry is None:
+                entry = await self._verify_token(token, cache_key)
+            payload, scopes = entry
 
             if security_scopes.scopes:
-                self._enforce_scopes(payload, security_scopes.scopes)
+                self._enforce_scopes(scopes, security_scopes.scopes)
 
             return payload
-        except Exception as e:
-            # For deployment, return a mock response instead of failing
-            # But only for endpoints that don't require specific scopes
-            if not security_scopes.scopes:
+        except UnauthorizedException:
+            # Mock payloads are for deployment testing only, must be enabled explicitly,
+            # and are never handed to endpoints that require specific scopes
+            if self.config.enable_mock_auth and not security_scopes.scopes:
                 return {
                     "user_id": "mock-user-id",
                     "email": "mock@example.com",
                     "note": "Mock response for deployment testing"
                 }
-            else:
-                # For scoped endpoints, fail properly
-                raise UnauthorizedException(f"Token validation failed: {str(e)}")
+            raise
+
+    async def _verify_token(self, token: str, cache_key: bytes) -> Tuple[dict, Optional[FrozenSet[str]]]:
+        key = await self._get_signing_key(token)
+        # RSA verification is CPU-bound; run it in a worker thread so the event loop keeps serving
+        payload = await asyncio.to_thread(self._decode_token, token, key)
+        return self._cache_payload(cache_key, payload)
+
+    def _get_cached_payload(self, cache_key: bytes) -> Optional[Tuple[dict, Optional[FrozenSet[str]]]]:
+        with self._payload_cache_lock:
+            entry = self._payload_cache.get(cache_key)
+        if entry is None:
+            return None
+        payload, scopes, expires_at = entry
+        # The cache TTL is a ceiling; never serve a payload past the token's own expiry
+        if time.time() >= expires_at:
+            return None
+        return payload, scopes
 
-    def _get_signing_key(self, token: str):
-        if self.jwks_client is None:
-            raise Exception("JWKS client not available")
+    def _cache_payload(self, cache_key: bytes, payload: dict) -> Tuple[dict, Optional[FrozenSet[str]]]:
+        # The parsed scope set is cached alongside the payload so cache hits don't rebuild it
+        scopes = self._parse_scopes(payload)
+        expires_at = time.time() + self._payload_cache.ttl
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        with self._payload_cache_lock:
+            self._payload_cache[cache_key] = (payload, scopes, expires_at)
+        return payload, scopes
+
+    async def aclose(self):
+        if self._owns_http_client:
+            await self.jwks_http.aclose()
+
+    async def _get_signing_key(self, token: str) -> RSAPublicKey:
         try:
-            return self.jwks_client.get_signing_key_from_jwt(token).key
-        except Exception as e:
-            raise UnauthorizedException(f"Failed to fetch signing key: {str(e)}")
+            kid = jwt.get_unverified_header(token).get("kid")
+            if not isinstance(kid, str):
+                raise UnauthorizedException("Invalid token header")
+            signing_key = None
+            if time.monotonic() < self._jwks_expires_at:
+                signing_key = self._signing_keys.get(kid)
+            if signing_key is None:
+                # Either the keys went stale or the kid is unknown (key rotation)
+                signing_key = await self._refresh_jwks(kid)
+            if signing_key is None:
+                raise UnauthorizedException(f'Unable to find a signing key that matches: "{kid}"')
+            return signing_key
+        except jwt.InvalidTokenError:
+            # Covers undecodable headers and those PyJWT rejects outright, such as a non-string kid
+            raise UnauthorizedException("Invalid token header") from None
+        except (httpx.HTTPError, ValueError):
+            raise UnauthorizedException("Failed to fetch signing key") from None
+
+    async def _refresh_jwks(self, kid: str) -> Optional[RSAPublicKey]:
+        async with self._jwks_lock:
+            now = time.monotonic()
+            if now < self._jwks_expires_at:
+                # Another request may have refreshed the keys while we were waiting on the lock
+                if kid in self._signing_keys:
+                    return self._signing_keys[kid]
+                if now - self._jwks_fetched_at < self._jwks_min_refresh_interval:
+                    return None
+            if self._jwks_failed_at is not None and now - self._jwks_failed_at < self._jwks_retry_backoff:
+                return self._fallback_signing_key(kid)
+
+            headers = {"User-Agent": jwks_user_agent}
+            if self._jwks_etag:
+                headers["If-None-Match"] = self._jwks_etag
+            if self._jwks_last_modified:
+                headers["If-Modified-Since"] = self._jwks_last_modified
+
+            try:
+                response = await self.jwks_http.get(self.jwks_url, headers=headers)
+                if response.status_code != 304:
+                    response.raise_for_status()
+                    self._signing_keys = self._parse_jwks(orjson.loads(response.content))
+                    self._jwks_etag = response.headers.get("etag")
+                    self._jwks_last_modified = response.headers.get("last-modified")
+            except (httpx.HTTPError, ValueError) as error:
+                logger.warning("JWKS fetch failed: %r", error)
+                self._jwks_failed_at = time.monotonic()
+                return self._fallback_signing_key(kid)
+            self._jwks_failed_at = None
+            self._jwks_fetched_at = time.monotonic()
+            self._jwks_expires_at = self._jwks_fetched_at + self._jwks_max_age(response)
+            return self._signing_keys.get(kid)
 
-    def _decode_token(self, token: str, key):
+    def _fallback_signing_key(self, kid: str) -> RSAPublicKey:
+        # While the JWKS can't be fetched, keys from the last good response keep verifying tokens
+        signing_key = self._signing_keys.get(kid)
+        if signing_key is None:
+            raise ValueError("JWKS unavailable")
+        return signing_key
+
+    def _parse_jwks(self, jwks: dict) -> Dict[str, RSAPublicKey]:
+        # A ValueError surfaces as "Failed to fetch signing key" in _get_signing_key
+        if not isinstance(jwks, dict) or not isinstance(jwks.get("keys", []), list):
+            raise ValueError("Invalid JWKS")
+        signing_keys = {}
+        for jwk in jwks.get("keys", []):
+            if not isinstance(jwk, dict) or not isinstance(jwk.get("kid"), str) or jwk.get("use", "sig") != "sig":
+                continue
+            try:
+                key = PyJWK(jwk).key
+            except (jwt.PyJWTError, TypeError, ValueError):
+                # As in PyJWKSet, one unusable entry (no kty, unsupported kty, bad RSA numbers,
+                # which cryptography rejects with ValueError) mustn't break the other keys
+                continue
+            # Keep the materialized RSAPublicKey so jwt.decode can use it as-is instead of
+            # re-deriving it from the JWK on every request
+            if isinstance(key, RSAPublicKey):
+                signing_keys[jwk["kid"]] = key
+        return signing_keys
+
+    def _jwks_max_age(self, response: httpx.Response) -> int:
+        match = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+        if match is None:
+            return self._jwks_ttl
+        # Don't let a tiny max-age turn every request into a revalidation
+        return max(int(match.group(1)), 60)
+
+    def _decode_token(self, token: str, key: RSAPublicKey) -> dict:
+        # RS256 is verified directly against the cached RSAPublicKey: PyJWT's decode adds
+        # algorithm lookup, options merging and a second header parse on every call.
         try:
-            project_id = os.getenv("DESCOPE_PROJECT_ID")
-            issuer_candidates = [
-                f'https://api.descope.com/v1/apps/{project_id}', 
-                project_id
-            ]
-            return jwt.decode(
-                token,
-                key,
-                algorithms=self.allowed_algorithms,
-                issuer=issuer_candidates,
-                audience=project_id
+            signing_input, _, signature = token.rpartition(".")
+            header_b64, _, payload_b64 = signing_input.partition(".")
+            header = orjson.loads(base64url_decode(header_b64))
+            if not isinstance(header, dict) or header.get("alg") not in self.allowed_algorithms:
+                raise UnauthorizedException("Token decoding failed: The specified alg value is not allowed")
+            key.verify(
+                base64url_decode(signature),
+                signing_input.encode(),
+                padding.PKCS1v15(),
+                hashes.SHA256()
             )
-        except Exception as e:
-            raise UnauthorizedException(f"Token decoding failed: {str(e)}")
+            payload = orjson.loads(base64url_decode(payload_b64))
+            if not isinstance(payload, dict):
+                raise UnauthorizedException("Token decoding failed: Invalid payload")
+        except InvalidSignature:
+            raise UnauthorizedException("Token decoding failed: Signature verification failed") from None
+        except ValueError:
+            # Malformed base64 or JSON (binascii.Error and orjson.JSONDecodeError are ValueErrors)
+            raise UnauthorizedException("Token decoding failed: Invalid token") from None
+
+        self._validate_claims(payload)
+        return payload
+
+    def _validate_claims(self, payload: dict):
+        now = time.time()
 
-    def _enforce_scopes(self, payload: dict, required_scopes: List[str]):
+        exp = payload.get("exp")
+        if exp is not None:
+            if not isinstance(exp, (int, float)):
+                raise UnauthorizedException("Token decoding failed: Expiration Time claim (exp) must be a number")
+            if exp <= now:
+                raise UnauthorizedException("Token decoding failed: Signature has expired")
+
+        nbf = payload.get("nbf")
+        if nbf is not None:
+            if not isinstance(nbf, (int, float)):
+                raise UnauthorizedException("Token decoding failed: Not Before claim (nbf) must be a number")
+            if nbf > now:
+                raise UnauthorizedException("Token decoding failed: The token is not yet valid (nbf)")
+
+        if "iss" not in payload:
+            raise UnauthorizedException('Token decoding failed: Token is missing the "iss" claim')
+        iss = payload["iss"]
+        if not isinstance(iss, str) or iss not in self._issuers:
+            raise UnauthorizedException("Token decoding failed: Invalid issuer")
+
+        aud = payload.get("aud")
+        if aud is None:
+            raise UnauthorizedException('Token decoding failed: Token is missing the "aud" claim')
+        audiences = [aud] if isinstance(aud, str) else aud
+        if not isinstance(audiences, list) or self._audience not in audiences:
+            raise UnauthorizedException("Token decoding failed: Audience doesn't match")
+
+    def _parse_scopes(self, payload: dict) -> Optional[FrozenSet[str]]:
         scope_claim = payload.get("scope")
         if scope_claim is None:
+            return None
+        if isinstance(scope_claim, str):
+            return frozenset(scope_claim.split())
+        if isinstance(scope_claim, list):
+            return frozenset(scope for scope in scope_claim if isinstance(scope, str))
+        return frozenset()
+
+    def _enforce_scopes(self, scopes: Optional[FrozenSet[str]], required_scopes: List[str]):
+        if scopes is None:
             raise UnauthorizedException('Missing required claim: "scope"')
 
-        scopes = scope_claim.split() if isinstance(scope_claim, str) else scope_claim
         missing = [scope for scope in required_scopes if scope not in scopes]
 
-        print(f"Token scopes: {scopes}")
-        print(f"Required scopes: {required_scopes}")
-        print(f"Missing scopes: {missing}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Token scopes: %s", sorted(scopes))
+            logger.debug("Required scopes: %s", required_scopes)
+            logger.debug("Missing scopes: %s", missing)
 
         if missing:
             raise UnauthorizedException(
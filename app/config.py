@@ -0,0 +1,48 @@
+from functools import cached_property, lru_cache
+from typing import Optional, Tuple
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """Application settings, read from the environment and an optional .env file."""
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    descope_project_id: Optional[str] = None
+    descope_api_base_url: str = "https://api.descope.com"
+    descope_inbound_app_client_id: Optional[str] = None
+    descope_inbound_app_client_secret: Optional[str] = None
+    # Return a placeholder payload instead of failing when an unscoped route gets a bad token.
+    # For deployment testing only; never enable this in production.
+    enable_mock_auth: bool = False
+    # Level for the app's own loggers; DEBUG adds (redacted) request and OAuth details
+    log_level: str = "INFO"
+    # API key for the example /api/external/weather route
+    openweather_api_key: Optional[str] = None
+    # Verified token payloads are reused for up to this many seconds (never past the token's exp).
+    # This also bounds how long a token keeps working after its signing key is pulled from the JWKS.
+    token_cache_ttl: int = 300
+    token_cache_size: int = 10000
+
+    # Derived values are computed once per Settings instance rather than on every access
+
+    @cached_property
+    def jwks_url(self) -> str:
+        return f"{self.descope_api_base_url.rstrip('/')}/{self.descope_project_id}/.well-known/jwks.json"
+
+    @cached_property
+    def issuer_candidates(self) -> Tuple[Optional[str], ...]:
+        return (
+            f"{self.descope_api_base_url.rstrip('/')}/v1/apps/{self.descope_project_id}",
+            self.descope_project_id
+        )
+
+    @cached_property
+    def audience(self) -> Optional[str]:
+        return self.descope_project_id
+
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
@@ -1,55 +1,133 @@
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 from fastapi import FastAPI, Security, HTTPException, Request, Form
-from fastapi.responses import RedirectResponse
+from pydantic import BaseModel, ValidationError
+from python_multipart.exceptions import FormParserError
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from fastapi.responses import ORJSONResponse, RedirectResponse, Response
 from app.auth import TokenVerifier
+from app.config import get_settings
 import httpx
-import json
-from typing import Optional
-import urllib.request
-import os
-
-# We use PyJWKClient, which internally uses Python's built-in urllib.request, which sends requests
-# without a standard User-Agent header (e.g., it sends "Python-urllib/3.x").
-# Some CDNs or API gateways (like the one serving Descope's JWKS) may block such requests as they resemble bot traffic or security scanners.
-opener = urllib.request.build_opener()
-opener.addheaders = [('User-agent', 'Mozilla/5.0 (DescopeFastAPISampleApp)')]
-urllib.request.install_opener(opener)
-
-app = FastAPI()
-auth = TokenVerifier()
+import orjson
+from typing import Dict, List, Literal, Optional
+from cachetools import TTLCache
+from urllib.parse import parse_qsl, quote, urlencode
+
+logger = logging.getLogger(__name__)
+
+# Values that must never reach the logs: credentials, codes and tokens in OAuth bodies and headers
+SENSITIVE_FIELDS = frozenset({
+    "authorization", "cookie", "client_secret", "code", "code_verifier",
+    "access_token", "refresh_token", "id_token"
+})
+
+def redact(values) -> dict:
+    return {k: "***" if k.lower() in SENSITIVE_FIELDS else v for k, v in values.items()}
+
+# Settings are read once at import; handlers use this instance instead of re-reading the environment
+config = get_settings()
+
+# LOG_LEVEL always applies to the app's loggers. Uvicorn only configures its own loggers, so they
+# also get a handler unless the deployment has already set up logging itself.
+app_logger = logging.getLogger("app")
+app_logger.setLevel(config.log_level.upper())
+if not logging.getLogger().handlers and not app_logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    app_logger.addHandler(log_handler)
+
+# Fixed upstream URLs, defined once instead of inside the handlers
+DESCOPE_AUTHORIZE_URL = "https://api.descope.com/oauth2/v1/apps/authorize"
+DESCOPE_TOKEN_URL = "https://api.descope.com/oauth2/v1/apps/token"
+CUSTOM_GPT_CALLBACK_URL = "https://chat.openai.com/aip/g-52cb1e9d28639354d827969f698f2b8948133aa7/oauth/callback"
+JSONPLACEHOLDER_USERS_URL = "https://jsonplaceholder.typicode.com/users"
+OPENWEATHER_BASE_URL = "https://api.openweathermap.org/data/2.5/"
+# Relative to OPENWEATHER_BASE_URL; the API key is added by the client
+OPENWEATHER_WEATHER_PATH = "weather?lat=45.540237&lon=13.731839"
+
+# The parts of the Descope token exchange that are the same for every request
+TOKEN_REQUEST_BASE = {
+    "grant_type": "authorization_code",
+    "client_id": config.descope_inbound_app_client_id,
+    "client_secret": config.descope_inbound_app_client_secret
+}
+TOKEN_EXCHANGE_CONFIGURED = bool(config.descope_inbound_app_client_id and config.descope_inbound_app_client_secret)
+
+# A single client for all outbound calls, so connections and TLS sessions are reused across requests.
+# HTTP/2 lets concurrent calls to the same origin share one multiplexed connection.
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(5.0, connect=2.0),
+    limits=httpx.Limits(max_connections=256, max_keepalive_connections=128, keepalive_expiry=30.0)
+)
+# Descope gets its own HTTP/2 client: JWKS fetches and token exchanges multiplex over one connection,
+# and bursts of logins can't be starved by (or starve) the example upstream calls. The longer timeout
+# leaves room for Descope's token endpoint, which a failed login can't simply retry.
+descope_client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(10.0, connect=3.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+)
+auth = TokenVerifier(http_client=descope_client)
+# OpenWeather is called with the same base URL and API key every time, so both live on its own client
+openweather_client = httpx.AsyncClient(
+    base_url=OPENWEATHER_BASE_URL,
+    params={"appid": config.openweather_api_key} if config.openweather_api_key else None,
+    http2=True,
+    timeout=httpx.Timeout(5.0, connect=2.0)
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await auth.aclose()
+    await descope_client.aclose()
+    await openweather_client.aclose()
+    await http_client.aclose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     """Log all incoming requests for debugging"""
-    print(f"INCOMING REQUEST: {request.method} {request.url.path} - Headers: {dict(request.headers)}")
+    # Formatting the headers is skipped entirely unless DEBUG logging is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Incoming request: %s %s - Headers: %s", request.method, request.url.path, redact(request.headers))
     response = await call_next(request)
-    print(f"RESPONSE: {request.method} {request.url.path} - Status: {response.status_code}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Response: %s %s - Status: %s", request.method, request.url.path, response.status_code)
     return response
 
+# The root response never changes, so it is serialized once at import time
+ROOT_RESPONSE_BODY = orjson.dumps({
+    "message": "FastAPI Sample App with Descope Authentication",
+    "version": "1.0.0",
+    "endpoints": {
+        "public": "/api/public",
+        "private": "/api/private",
+        "scoped_usage_read": "/api/private-scoped/usage/read",
+        "scoped_logs_read": "/api/private-scoped/logs/read",
+        "scoped_ci_trigger": "/api/private-scoped/ci/trigger",
+        "scoped_ci_read": "/api/private-scoped/ci/read",
+        "external_users": "/api/external/users",
+        "external_weather": "/api/external/weather",
+        "custom_api": "/api/custom/{endpoint}",
+        "batch": "/api/batch"
+    },
+    "oauth_endpoints": {
+        "authorize": "/authorize",
+        "token": "/token"
+    },
+    "docs": "/docs",
+    "redoc": "/redoc"
+})
+ROOT_RESPONSE_HEADERS = {"Cache-Control": "public, max-age=3600"}
+
 @app.get("/")
-def root():
+async def root():
     """Root endpoint - API information"""
-    print("Root endpoint accessed")
-    return {
-        "message": "FastAPI Sample App with Descope Authentication",
-        "version": "1.0.0",
-        "endpoints": {
-            "public": "/api/public",
-            "private": "/api/private",
-            "scoped_usage_read": "/api/private-scoped/usage/read",
-            "scoped_logs_read": "/api/private-scoped/logs/read",
-            "scoped_ci_trigger": "/api/private-scoped/ci/trigger",
-            "scoped_ci_read": "/api/private-scoped/ci/read",
-            "external_users": "/api/external/users",
-            "external_weather": "/api/external/weather",
-            "custom_api": "/api/custom/{endpoint}"
-        },
-        "oauth_endpoints": {
-            "authorize": "/authorize",
-            "token": "/token"
-        },
-        "docs": "/docs",
-        "redoc": "/redoc"
-    }
+    return Response(content=ROOT_RESPONSE_BODY, media_type="application/json", headers=ROOT_RESPONSE_HEADERS)
 
 @app.get("/authorize")
 async def authorize(
@@ -64,12 +142,12 @@ async def authorize(
     
     This endpoint forwards OAuth authorization requests to Descope's Inbound Apps.
     """
-    print(f"Authorization request received - response_type: {response_type}, scope: {scope}, state: {state}")
-    
+    logger.debug("Authorization request received - response_type: %s, scope: %s", response_type, scope)
+
     try:
         # Validate required parameters
         if not redirect_uri or not response_type:
-            print(f"Missing required parameters - redirect_uri: {bool(redirect_uri)}, response_type: {bool(response_type)}")
+            logger.info("Authorization request missing parameters - redirect_uri: %s, response_type: %s", bool(redirect_uri), bool(response_type))
             raise HTTPException(
                 status_code=400,
                 detail={
@@ -80,7 +158,7 @@ async def authorize(
 
         # Validate response_type
         if response_type != "code":
-            print(f"Unsupported response_type: {response_type}")
+            logger.info("Unsupported response_type: %s", response_type)
             raise HTTPException(
                 status_code=400,
                 detail={
@@ -90,13 +168,10 @@ async def authorize(
             )
         
         # Get client ID from environment or use the provided one
-        descope_client_id = os.getenv('DESCOPE_INBOUND_APP_CLIENT_ID')
-        
-        print(f"Client ID available: {bool(descope_client_id)}")
-        print(f"Client ID length: {len(descope_client_id) if descope_client_id else 0}")
-        
+        descope_client_id = config.descope_inbound_app_client_id
+
         if not descope_client_id:
-            print("OAuth client credentials not configured")
+            logger.error("OAuth client credentials not configured")
             raise HTTPException(
                 status_code=500,
                 detail={
@@ -108,37 +183,41 @@ async def authorize(
         # Get the base URL from the request
         base_url = str(request.base_url).rstrip('/')
         callback_url = f"{base_url}/api/oauth/callback"
-        
-        print(f"Base URL: {base_url}")
-        print(f"Callback URL: {callback_url}")
-        
+
         # Construct query parameters
         params = {
             "client_id": descope_client_id,
             "redirect_uri": callback_url,
             "response_type": "code",
-            "scope": scope or "openid",
-            "state": state or ""  # Just pass through the state parameter
+            "scope": scope or "openid"
         }
-        
-        # Build the full URL with query parameters
-        query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-        full_url = f"https://api.descope.com/oauth2/v1/apps/authorize?{query_string}"
-        
-        print(f"Redirecting to Descope: {full_url}")
-        
+        # The client's state is passed through untouched; the callback hands it straight back
+        if state:
+            params["state"] = state
+
+        # Build the full URL with properly percent-encoded query parameters. quote (rather than
+        # quote_plus) encodes the spaces in scope as %20, which every OAuth server accepts.
+        full_url = f"{DESCOPE_AUTHORIZE_URL}?{urlencode(params, quote_via=quote)}"
+
+        logger.debug("Redirecting to Descope authorize endpoint with callback %s", callback_url)
+
         # Redirect to Descope's authorization endpoint
         return RedirectResponse(url=full_url)
         
     except HTTPException:
         raise
-    except Exception as error:
-        print(f"Authorization endpoint error: {error}")
+    except Exception:
+        logger.exception("Authorization endpoint error")
         raise HTTPException(
             status_code=500
             
         )
 
+class TokenRequest(BaseModel):
+    """The token request fields this proxy uses; anything else the client sends is ignored."""
+    grant_type: Optional[str] = None
+    code: Optional[str] = None
+
 @app.post("/token")
 async def token(
     request: Request
@@ -148,54 +227,60 @@ async def token(
     
     This endpoint forwards token exchange requests to Descope's Inbound Apps.
     """
-    print("Token exchange request received")
-    
+    logger.debug("Token exchange request received")
+
     try:
         # Parse the request body based on content type
         content_type = request.headers.get("content-type", "")
-        print(f"Request content-type: {content_type}")
-        
-        if "application/json" in content_type:
-            body = await request.json()
-        elif "application/x-www-form-urlencoded" in content_type:
-            form_data = await request.form()
-            body = dict(form_data)
-        else:
-            # Try to parse as JSON first, then as form data
-            try:
-                body = await request.json()
-            except:
-                form_data = await request.form()
-                body = dict(form_data)
-        
-        print(f"Request body: {body}")
-        
-        grant_type = body.get("grant_type")
-        code = body.get("code")
-        client_id = os.getenv('DESCOPE_INBOUND_APP_CLIENT_ID')
-        client_secret = os.getenv('DESCOPE_INBOUND_APP_CLIENT_SECRET')
-
-        print(f"Grant type: {grant_type}")
-        print(f"Code available: {bool(code)}")
-        print(f"Client ID available: {bool(client_id)}")
-        print(f"Client secret available: {bool(client_secret)}")
-        print(f"Client ID length: {len(client_id) if client_id else 0}")
-        print(f"Client secret length: {len(client_secret) if client_secret else 0}")
 
-        # Validate required parameters
-        if not grant_type or not code or not client_id or not client_secret:
-            print(f"Missing required parameters - grant_type: {bool(grant_type)}, code: {bool(code)}, client_id: {bool(client_id)}, client_secret: {bool(client_secret)}")
+        # Read the raw body once and validate the common content types straight from the bytes;
+        # JSON bodies go through pydantic's own parser without an intermediate dict
+        raw_body = await request.body()
+        try:
+            if "application/json" in content_type:
+                token_request = TokenRequest.model_validate_json(raw_body)
+            elif "application/x-www-form-urlencoded" in content_type:
+                token_request = TokenRequest.model_validate(dict(parse_qsl(raw_body.decode())))
+            else:
+                # Try to parse as JSON first, then as form data
+                try:
+                    token_request = TokenRequest.model_validate_json(raw_body)
+                except ValidationError:
+                    form_data = await request.form()
+                    token_request = TokenRequest.model_validate(dict(form_data))
+        # A multipart body Starlette can't parse (e.g. no boundary) raises its own HTTPException;
+        # malformed parts surface as python-multipart's FormParserError
+        except (ValidationError, UnicodeDecodeError, FormParserError, StarletteHTTPException):
+            logger.info("Malformed token request body (%s)", content_type)
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "error": "invalid_request",
+                    "error_description": "Malformed token request"
+                }
+            )
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Token request (%s): %s", content_type, redact(token_request.model_dump()))
+
+        grant_type = token_request.grant_type
+        code = token_request.code
+
+        # Validate required parameters. The client's own client_id/client_secret are not checked:
+        # the exchange always uses this server's inbound app credentials.
+        if not grant_type or not code:
+            logger.info("Token request missing parameters - grant_type: %s, code: %s", bool(grant_type), bool(code))
             raise HTTPException(
                 status_code=400,
                 detail={
                     "error": "invalid_request",
-                    "error_description": f"Missing required parameters + {bool(grant_type)} + {bool(code)} + {bool(client_id)} + {bool(client_secret)}"
+                    "error_description": "Missing required parameters: grant_type and code"
                 }
             )
 
         # Only support authorization_code grant type
         if grant_type != "authorization_code":
-            print(f"Unsupported grant_type: {grant_type}")
+            logger.info("Unsupported grant_type: %s", grant_type)
             raise HTTPException(
                 status_code=400,
                 detail={
@@ -205,10 +290,8 @@ async def token(
             )
 
         # Check if we have the required environment variables
-        if len(client_id) == 0 or len(client_secret) == 0:
-            print("Missing environment variables for token exchange")
-            print(f"CLIENT_ID: {bool(client_id)}")
-            print(f"CLIENT_SECRET: {bool(client_secret)}")
+        if not TOKEN_EXCHANGE_CONFIGURED:
+            logger.error("OAuth client credentials not configured for token exchange")
             raise HTTPException(
                 status_code=500,
                 detail={
@@ -221,48 +304,30 @@ async def token(
         base_url = str(request.base_url).rstrip('/')
         callback_url = f"{base_url}/api/oauth/callback"
 
-        print(f"Base URL: {base_url}")
-        print(f"Callback URL: {callback_url}")
-
         # Forward the request to Descope's token endpoint
-        token_request_body = {
-            "grant_type": "authorization_code",
-            "client_id": os.getenv('DESCOPE_INBOUND_APP_CLIENT_ID'),
-            "client_secret": os.getenv('DESCOPE_INBOUND_APP_CLIENT_SECRET'),
-            "code": code,
-            "redirect_uri": callback_url
-        }
-
-        print(f"Token exchange request body: {token_request_body}")
-        print(f"Token exchange URL: https://api.descope.com/oauth2/v1/apps/token")
-
-        descope_url = "https://api.descope.com/oauth2/v1/apps/token"
-        
-        async with httpx.AsyncClient() as client:
-            print("Sending request to Descope token endpoint")
-            response = await client.post(
-                descope_url,
-                data=token_request_body,
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
-            
-            descope_data = response.json()
-            
-            # Log the response for debugging
-            print(f"Descope token response status: {response.status_code}")
-            print(f"Descope token response data: {descope_data}")
+        token_request_body = {**TOKEN_REQUEST_BASE, "code": code, "redirect_uri": callback_url}
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Token exchange request to %s: %s", DESCOPE_TOKEN_URL, redact(token_request_body))
+        response = await descope_client.post(
+            DESCOPE_TOKEN_URL,
+            data=token_request_body,
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
 
-            # If Descope returned an error, log it
-            if response.status_code >= 400:
-                print(f"Descope token exchange failed: {descope_data}")
+        # If Descope returned an error, log it (error bodies carry no tokens)
+        if response.status_code >= 400:
+            logger.warning("Descope token exchange failed (%s): %s", response.status_code, response.text)
+        else:
+            logger.debug("Descope token exchange succeeded (%s)", response.status_code)
 
-            # Return the response from Descope
-            return descope_data
+        # Return the response from Descope as-is, without decoding and re-encoding the tokens
+        return json_response(upstream_json(response))
             
     except HTTPException:
         raise
-    except Exception as error:
-        print(f"Token endpoint error: {error}")
+    except Exception:
+        logger.exception("Token endpoint error")
         raise HTTPException(
             status_code=500,
             detail={
@@ -284,16 +349,12 @@ async def oauth_callback(
     
     Handles the callback from Descope and redirects back to Custom GPT.
     """
-    print(f"OAuth callback received - code: {bool(code)}, state: {state}, error: {error}")
-    print(f"Full callback URL: {request.url}")
-    print(f"Code value: {code}")
-    print(f"State value: {state}")
-    print(f"All query params: {dict(request.query_params)}")
-    
+    logger.debug("OAuth callback received - code: %s, state: %s, error: %s", bool(code), bool(state), error)
+
     try:
         # Handle errors from Descope
         if error:
-            print(f"Descope authorization error: {error}, {error_description}")
+            logger.warning("Descope authorization error: %s, %s", error, error_description)
             raise HTTPException(
                 status_code=400,
                 detail={
@@ -303,8 +364,7 @@ async def oauth_callback(
             )
 
         if not code:
-            print("No authorization code received")
-            print(f"All query parameters: {dict(request.query_params)}")
+            logger.info("No authorization code received")
             raise HTTPException(
                 status_code=400,
                 detail={
@@ -313,24 +373,18 @@ async def oauth_callback(
                 }
             )
 
-        # Custom GPT callback URL
-        custom_gpt_callback = "https://chat.openai.com/aip/g-52cb1e9d28639354d827969f698f2b8948133aa7/oauth/callback"
-        
-        # Build redirect URL back to Custom GPT
-        redirect_url = f"{custom_gpt_callback}?code={code}"
-        if state:
-            redirect_url += f"&state={state}"
-        
-        print(f"Custom GPT callback URL: {custom_gpt_callback}")
-        print(f"Full redirect URL: {redirect_url}")
-        print(f"Redirect URL length: {len(redirect_url)}")
+        # Build redirect URL back to Custom GPT, passing state back exactly as received
+        callback_params = {"code": code, "state": state} if state else {"code": code}
+        redirect_url = f"{CUSTOM_GPT_CALLBACK_URL}?{urlencode(callback_params, quote_via=quote)}"
+
+        logger.debug("Redirecting to Custom GPT callback %s", CUSTOM_GPT_CALLBACK_URL)
 
         return RedirectResponse(url=redirect_url)
         
     except HTTPException:
         raise
-    except Exception as error:
-        print(f"Callback endpoint error: {error}")
+    except Exception:
+        logger.exception("Callback endpoint error")
         raise HTTPException(
             status_code=500,
             detail={
@@ -340,142 +394,226 @@ async def oauth_callback(
         )
 
 
+# Also static, and often used as a health check, so it is pre-serialized like the root response
+PUBLIC_RESPONSE_BODY = orjson.dumps({
+    "status": "success",
+    "msg": "Success! This endpoint is publicly available and requires no authentication."
+})
+PUBLIC_RESPONSE_HEADERS = {"Cache-Control": "public, max-age=60"}
+
 @app.get("/api/public")
-def public():
+async def public():
     """Public Route: No Authentication required."""
-    result = {
-        "status": "success",
-        "msg": "Success! This endpoint is publicly available and requires no authentication."
-    }
-    return result
+    return Response(content=PUBLIC_RESPONSE_BODY, media_type="application/json", headers=PUBLIC_RESPONSE_HEADERS)
 
 
 @app.get("/api/private")
-def private(auth_result: str = Security(auth)):
+async def private(auth_result: str = Security(auth)):
     """
     This is a protected route.
 
     Access to this endpoint requires a valid JWT access token.
     The `auth` dependency uses FastAPI's `Security` to perform token verification before entering this route.
     """
-    return auth_result
+    # Returning the response directly skips jsonable_encoder; the payload already holds only JSON types
+    return ORJSONResponse(auth_result)
 
 
-@app.get("/api/private-scoped/usage/read")
-def private_scoped(auth_result: str = Security(auth, scopes=['usage:read'])):
-    """
-    This is a protected route with scope-based access control.
+# The scoped routes differ only in the scope they require, so they are generated from one factory
+private_scoped_routes = {
+    "/api/private-scoped/usage/read": "usage:read",
+    "/api/private-scoped/logs/read": "logs:read",
+    "/api/private-scoped/ci/trigger": "ci:trigger",
+    "/api/private-scoped/ci/read": "ci:read",
+}
 
-    Access to this endpoint requires:
-    - A valid access token (authentication), and
-    - The presence of the `usage:read` scope in the token.
-    """
-    return auth_result
+def make_private_scoped(scope: str):
+    async def private_scoped(auth_result: str = Security(auth, scopes=[scope])):
+        return ORJSONResponse(auth_result)
 
-@app.get("/api/private-scoped/logs/read")
-def private_scoped(auth_result: str = Security(auth, scopes=['logs:read'])):
-    """
+    # Give each generated handler its own name (e.g. private_scoped_usage_read) for OpenAPI and tracebacks
+    private_scoped.__name__ = private_scoped.__qualname__ = "private_scoped_" + scope.replace(":", "_")
+    private_scoped.__doc__ = f"""
     This is a protected route with scope-based access control.
 
     Access to this endpoint requires:
     - A valid access token (authentication), and
-    - The presence of the `logs:read` scope in the token.
+    - The presence of the `{scope}` scope in the token.
     """
-    return auth_result
+    return private_scoped
 
-@app.get("/api/private-scoped/ci/trigger")
-def private_scoped(auth_result: str = Security(auth, scopes=['ci:trigger'])):
-    """
-    This is a protected route with scope-based access control.
+for path, scope in private_scoped_routes.items():
+    app.get(path)(make_private_scoped(scope))
 
-    Access to this endpoint requires:
-    - A valid access token (authentication), and
-    - The presence of the `ci:trigger` scope in the token.
-    """
-    return auth_result
+# Upstream JSON is handled as raw bytes and spliced into our response envelopes,
+# so payloads are never re-serialized on the way through
 
-@app.get("/api/private-scoped/ci/read")
-def private_scoped(auth_result: str = Security(auth, scopes=['ci:read'])):
-    """
-    This is a protected route with scope-based access control.
+def upstream_json(response: httpx.Response) -> bytes:
+    # The body must be exactly one complete JSON value before it is spliced in; otherwise a
+    # malformed or crafted upstream body (e.g. `1,"status":...`) could break or rewrite the envelope.
+    # Invalid bodies are reported as a bad gateway and never returned or cached.
+    try:
+        orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=502, detail="Upstream API returned invalid JSON") from None
+    return response.content
+
+def splice_json(fields: dict, key: str, payload: bytes) -> bytes:
+    """Serialize `fields` as a JSON object with the pre-encoded `payload` added under `key`."""
+    head = orjson.dumps(fields)[:-1]
+    separator = b"," if len(head) > 1 else b""
+    return head + separator + orjson.dumps(key) + b":" + payload + b"}"
+
+def json_response(content: bytes) -> Response:
+    return Response(content=content, media_type="application/json")
+
+# Short-lived caches for upstream responses that don't change between calls
+weather_cache = TTLCache(maxsize=4, ttl=60)
+custom_api_cache = TTLCache(maxsize=256, ttl=5)
+# Fetches currently in flight by URL, so concurrent cache misses share one upstream call
+inflight_fetches: Dict[str, asyncio.Future] = {}
+
+async def get_json_cached(cache: TTLCache, url: str, client: httpx.AsyncClient = http_client):
+    data = cache.get(url)
+    if data is not None:
+        return data
+    fetch = inflight_fetches.get(url)
+    if fetch is None:
+        fetch = asyncio.ensure_future(fetch_json(cache, url, client))
+        inflight_fetches[url] = fetch
+        fetch.add_done_callback(lambda _: inflight_fetches.pop(url, None))
+    # Shielded so a cancelled caller doesn't cancel the fetch other callers are waiting on
+    return await asyncio.shield(fetch)
+
+async def fetch_json(cache: TTLCache, url: str, client: httpx.AsyncClient):
+    response = await client.get(url)
+    data = upstream_json(response)
+    # Only successful responses are cached; upstream errors are retried on the next call
+    if response.is_success:
+        cache[url] = data
+    return data
+
+async def fetch_users():
+    response = await http_client.get(JSONPLACEHOLDER_USERS_URL)
+    return upstream_json(response)
+
+async def fetch_weather():
+    # You would replace this with your actual weather API
+    # Example API call (replace with your actual API)
+    return await get_json_cached(weather_cache, OPENWEATHER_WEATHER_PATH, openweather_client)
 
-    Access to this endpoint requires:
-    - A valid access token (authentication), and
-    - The presence of the `ci:read` scope in the token.
-    """
-    return auth_result
+# Replace with your actual API base URL
+CUSTOM_API_BASE_URL = "https://your-api.com/api"
+
+def is_path_segment(endpoint: Optional[str]) -> bool:
+    # Dot segments and separators would let an endpoint reach outside CUSTOM_API_BASE_URL
+    return bool(endpoint) and endpoint not in (".", "..") and not any(c in endpoint for c in "/?#\\")
+
+async def fetch_custom(endpoint: str, params: Optional[Dict[str, str]] = None):
+    # Like the /api/custom/{endpoint} route, the endpoint is always a single path segment
+    url = f"{CUSTOM_API_BASE_URL}/{quote(endpoint, safe='')}"
+    if params:
+        url += "?" + urlencode(params, quote_via=quote)
+    return await get_json_cached(custom_api_cache, url)
 
 # Example: Call external API (JSONPlaceholder)
 @app.get("/api/external/users")
 async def get_external_users():
     """Example: Call external API to get users"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get("https://jsonplaceholder.typicode.com/users")
-        return {
-            "status": "success",
-            "data": response.json(),
-            "source": "External API: JSONPlaceholder"
-        }
+    return json_response(splice_json(
+        {"status": "success", "source": "External API: JSONPlaceholder"},
+        "data", await fetch_users()
+    ))
 
 # Example: Call external API with authentication
 @app.get("/api/external/weather")
 async def get_weather(auth_result: str = Security(auth)):
     """Example: Call weather API (requires authentication)"""
-    # You would replace this with your actual weather API
-    async with httpx.AsyncClient() as client:
-        # Example API call (replace with your actual API)
-        response = await client.get("https://api.openweathermap.org/data/2.5/weather?lat=45.540237&lon=13.731839&appid=6b0bb55a1a72b6fefb0b5abc1e72ced4")
-        return {
-            "status": "success",
-            "user": auth_result,
-            "weather_data": response.json(),
-            "source": "External API: OpenWeatherMap"
-        }
+    return json_response(splice_json(
+        {"status": "success", "user": auth_result, "source": "External API: OpenWeatherMap"},
+        "weather_data", await fetch_weather()
+    ))
 
 # Example: Call your own custom API
 @app.get("/api/custom/{endpoint}")
 async def call_custom_api(endpoint: str, auth_result: str = Security(auth)):
     """Example: Call your custom API with dynamic endpoint"""
-    # Replace with your actual API base URL
-    base_url = "https://your-api.com/api"
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{base_url}/{endpoint}")
-        return {
-            "status": "success",
-            "user": auth_result,
-            "endpoint": endpoint,
-            "data": response.json(),
-            "source": f"Custom API: {base_url}"
-        }
+    return json_response(splice_json(
+        {"status": "success", "user": auth_result, "endpoint": endpoint, "source": f"Custom API: {CUSTOM_API_BASE_URL}"},
+        "data", await fetch_custom(endpoint)
+    ))
+
+class BatchReq(BaseModel):
+    """One sub-request of /api/batch: the users or weather example, or an endpoint of your custom API."""
+    api: Literal["users", "weather", "custom"]
+    # Custom API only: a single path segment, as in /api/custom/{endpoint}
+    endpoint: Optional[str] = None
+    params: Optional[Dict[str, str]] = None
+
+# Caps the upstream fan-out a single batch call can trigger
+MAX_BATCH_SIZE = 20
+
+def batch_fetch(req: BatchReq):
+    if req.api == "users":
+        return fetch_users()
+    if req.api == "weather":
+        return fetch_weather()
+    return fetch_custom(req.endpoint, req.params)
+
+# Example: Call several of the APIs above in one round trip
+@app.post("/api/batch")
+async def batch(reqs: List[BatchReq], auth_result: str = Security(auth)):
+    """Example: Fetch several external/custom API results concurrently (requires authentication)"""
+    if len(reqs) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_SIZE} requests can be batched"
+        )
+    if not all(is_path_segment(req.endpoint) for req in reqs if req.api == "custom"):
+        raise HTTPException(
+            status_code=400,
+            detail="Custom API requests need an endpoint that is a single path segment"
+        )
+
+    # Sub-requests run concurrently on the shared client; one failing doesn't fail the others
+    results = await asyncio.gather(*(batch_fetch(req) for req in reqs), return_exceptions=True)
+    items = [
+        orjson.dumps({"api": req.api, "endpoint": req.endpoint, "status": "error", "error": str(result) or type(result).__name__})
+        if isinstance(result, Exception) else
+        splice_json({"api": req.api, "endpoint": req.endpoint, "status": "success"}, "data", result)
+        for req, result in zip(reqs, results)
+    ]
+    return json_response(splice_json(
+        {"status": "success", "user": auth_result},
+        "results", b"[" + b",".join(items) + b"]"
+    ))
+
+TEST_TOKEN_ENDPOINT_RESPONSE_BODY = orjson.dumps({
+    "message": "Token endpoint is accessible",
+    "status": "ok",
+    "timestamp": "2024-01-01T00:00:00Z"
+})
 
 @app.get("/test-token-endpoint")
-def test_token_endpoint():
+async def test_token_endpoint():
     """Test endpoint to verify token endpoint is accessible"""
-    print("Test token endpoint accessed")
-    return {
-        "message": "Token endpoint is accessible",
-        "status": "ok",
-        "timestamp": "2024-01-01T00:00:00Z"
-    }
+    return Response(content=TEST_TOKEN_ENDPOINT_RESPONSE_BODY, media_type="application/json")
 
 @app.get("/test-oauth-flow")
 async def test_oauth_flow():
     """Test endpoint to simulate the OAuth flow"""
-    print("Testing OAuth flow simulation")
-    
     # Step 1: Simulate getting an authorization code
     auth_url = "https://fast-api-for-custom-gpt.vercel.app/authorize"
-    print(f"Step 1: Authorization URL: {auth_url}")
-    
+    logger.info("Step 1: Authorization URL: %s", auth_url)
+
     # Step 2: Simulate the callback with a code
     callback_url = "https://fast-api-for-custom-gpt.vercel.app/api/oauth/callback?code=test_code_123&state=test_state"
-    print(f"Step 2: Callback URL: {callback_url}")
-    
+    logger.info("Step 2: Callback URL: %s", callback_url)
+
     # Step 3: Simulate token exchange
     token_url = "https://fast-api-for-custom-gpt.vercel.app/token"
-    print(f"Step 3: Token URL: {token_url}")
-    
+    logger.info("Step 3: Token URL: %s", token_url)
+
     return {
         "message": "OAuth flow test",
         "authorization_url": auth_url,
@@ -485,20 +623,18 @@ async def test_oauth_flow():
     }
 
 @app.get("/debug/env")
-def debug_env():
+async def debug_env():
     """Debug endpoint to check environment variables"""
-    print("Debug environment endpoint accessed")
-    
     env_vars = {
-        "DESCOPE_INBOUND_APP_CLIENT_ID": bool(os.getenv('DESCOPE_INBOUND_APP_CLIENT_ID')),
-        "DESCOPE_INBOUND_APP_CLIENT_SECRET": bool(os.getenv('DESCOPE_INBOUND_APP_CLIENT_SECRET')),
-        "DESCOPE_PROJECT_ID": os.getenv('DESCOPE_PROJECT_ID'),
-        "CLIENT_ID_LENGTH": len(os.getenv('DESCOPE_INBOUND_APP_CLIENT_ID')) if os.getenv('DESCOPE_INBOUND_APP_CLIENT_ID') else 0,
-        "CLIENT_SECRET_LENGTH": len(os.getenv('DESCOPE_INBOUND_APP_CLIENT_SECRET')) if os.getenv('DESCOPE_INBOUND_APP_CLIENT_SECRET') else 0,
+        "DESCOPE_INBOUND_APP_CLIENT_ID": bool(config.descope_inbound_app_client_id),
+        "DESCOPE_INBOUND_APP_CLIENT_SECRET": bool(config.descope_inbound_app_client_secret),
+        "DESCOPE_PROJECT_ID": config.descope_project_id,
+        "CLIENT_ID_LENGTH": len(config.descope_inbound_app_client_id or ""),
+        "CLIENT_SECRET_LENGTH": len(config.descope_inbound_app_client_secret or ""),
     }
-    
-    print(f"Environment variables status: {env_vars}")
-    
+
+    logger.info("Environment variables status: %s", env_vars)
+
     return {
         "message": "Environment variables debug info",
         "environment_variables": env_vars,
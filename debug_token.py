@@ -2,104 +2,306 @@
 """
 Debug script to help troubleshoot JWT token validation issues
 """
-import jwt
-import requests
+import argparse
+import base64
+import functools
 import json
+import os
+import re
+import socket
+import sys
+import time
 from urllib.parse import urlparse
 
+import jwt
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+
+from jwks_http import EXIT_FAILED, EXIT_OK, EXIT_TIMEOUT, JWKS_TMPL, http_get, loads_json
+
+# Fetched JWKS by URL: (expires_at, jwks, etag). Entries are fresh for the response's max-age, or
+# 5 minutes; after that they are revalidated with If-None-Match, and a 304 keeps the cached keys.
+_JWKS_CACHE = {}
+_JWKS_DEFAULT_TTL = 300
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+# Fetched JWKS are also kept on disk with their ETag: the next run within 5 minutes skips the
+# network entirely, and later runs revalidate the copy instead of downloading it again
+_JWKS_DISK_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "descope-jwks")
+_JWKS_DISK_CACHE_TTL = 300
+
+def _jwks_ttl(response_headers):
+    """Seconds the response may be cached for, from its Cache-Control header"""
+    cache_control = response_headers.get("Cache-Control", "")
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    match = _MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else _JWKS_DEFAULT_TTL
+
+def _jwks_disk_cache_path(jwks_url):
+    """Cache file for a JWKS URL, named after the project ID in its path"""
+    project_id = urlparse(jwks_url).path.strip('/').split('/')[0]
+    return os.path.join(_JWKS_DISK_CACHE_DIR, re.sub(r"[^\w.-]", "_", project_id) + ".jwks")
+
+def _read_jwks_disk_cache(jwks_url):
+    """The JWKS cached on disk for the URL as (jwks, etag, seconds left fresh), or None if missing or
+    unreadable. A stale copy is still returned, so it can be revalidated with its ETag."""
+    path = _jwks_disk_cache_path(jwks_url)
+    try:
+        ttl_left = os.stat(path).st_mtime + _JWKS_DISK_CACHE_TTL - time.time()
+        with open(path, 'rb') as f:
+            content = f.read()
+        # The first line holds the ETag (empty if there was none), the rest the raw response body
+        etag, _, body = content.partition(b"\n")
+        jwks = loads_json(body)
+        if not isinstance(jwks, dict):
+            return None
+        return jwks, etag.decode() or None, ttl_left
+    except (OSError, ValueError):
+        return None
+
+def _write_jwks_disk_cache(jwks_url, content, etag):
+    """Atomically store the raw JWKS response body with its ETag; the cache is best-effort, so failures are ignored"""
+    path = _jwks_disk_cache_path(jwks_url)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(_JWKS_DISK_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write((etag or "").encode() + b"\n" + content)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _touch_jwks_disk_cache(jwks_url):
+    """Mark the JWKS on disk fresh again after the server confirmed it with a 304"""
+    try:
+        os.utime(_jwks_disk_cache_path(jwks_url))
+    except OSError:
+        pass
+
+@functools.lru_cache(maxsize=128)
 def decode_jwt_header(token):
-    """Decode the JWT header without verification"""
+    """Decode the JWT header without verification (cached per token; treat the result as read-only)"""
     try:
-        header = jwt.get_unverified_header(token)
+        # The header is the first base64url segment; restore the padding JWTs strip off
+        segment = token.split('.', 1)[0]
+        segment += '=' * (-len(segment) % 4)
+        raw_header = base64.urlsafe_b64decode(segment)
+        header = loads_json(raw_header)
+        if not isinstance(header, dict):
+            raise ValueError("header is not a JSON object")
         return header
     except Exception as e:
         print(f"Error decoding JWT header: {e}")
         return None
 
-def fetch_jwks(jwks_url):
+def fetch_jwks(jwks_url, refresh=False):
     """Fetch the JWKS from the provided URL"""
+    return _fetch_jwks(jwks_url, refresh)[0]
+
+def _fetch_jwks(jwks_url, refresh=False):
+    """Fetch the JWKS; returns (jwks, from_cache). With refresh, fresh cached copies are bypassed,
+    though any cached copy may still be confirmed by a 304."""
+    cached = _JWKS_CACHE.get(jwks_url)
+    if not cached:
+        disk_cached = _read_jwks_disk_cache(jwks_url)
+        if disk_cached is not None:
+            jwks, etag, ttl_left = disk_cached
+            cached = _JWKS_CACHE[jwks_url] = (time.monotonic() + ttl_left, jwks, etag)
+    if not refresh and cached and time.monotonic() < cached[0]:
+        return cached[1], True
+    headers = {"If-None-Match": cached[2]} if cached and cached[2] else None
     try:
-        response = requests.get(jwks_url)
-        response.raise_for_status()
-        return response.json()
+        status, response_headers, content = http_get(jwks_url, headers)
+        etag = response_headers.get("ETag")
+        if status == 304 and cached:
+            jwks = cached[1]
+            etag = etag or cached[2]
+            if _jwks_ttl(response_headers):
+                _touch_jwks_disk_cache(jwks_url)
+        elif status == 200:
+            jwks = loads_json(content)
+            if _jwks_ttl(response_headers):
+                _write_jwks_disk_cache(jwks_url, content, etag)
+        else:
+            raise ValueError(f"HTTP {status} from {jwks_url}")
+        _JWKS_CACHE[jwks_url] = (time.monotonic() + _jwks_ttl(response_headers), jwks, etag)
+        return jwks, False
+    except socket.timeout:
+        print(f"Timed out fetching JWKS from {jwks_url}")
+        raise
     except Exception as e:
         print(f"Error fetching JWKS: {e}")
-        return None
+        return None, False
 
 def check_key_in_jwks(jwks, kid):
-    """Check if a specific key ID exists in the JWKS"""
+    """Check if a specific key ID exists in the JWKS; returns the matching JWK, or None"""
     if not jwks or 'keys' not in jwks:
         print("Invalid JWKS format")
-        return False
+        return None
     
+    # One pass builds the index; setdefault keeps the first key for a kid, like a linear search would
+    by_kid = {}
     for key in jwks['keys']:
-        if key.get('kid') == kid:
-            print(f"✅ Key ID '{kid}' found in JWKS")
-            print(f"   Key type: {key.get('kty')}")
-            print(f"   Algorithm: {key.get('alg')}")
-            return True
+        by_kid.setdefault(key.get('kid'), key)
+    key = by_kid.get(kid)
+    if key is not None:
+        print(f"✅ Key ID '{kid}' found in JWKS")
+        print(f"   Key type: {key.get('kty')}")
+        print(f"   Algorithm: {key.get('alg')}")
+        return key
     
     print(f"❌ Key ID '{kid}' NOT found in JWKS")
     print("Available key IDs:")
-    for key in jwks['keys']:
-        print(f"   - {key.get('kid')}")
-    return False
+    print("\n".join(f"   - {available_kid}" for available_kid in by_kid))
+    return None
+
+def _b64url_uint(value):
+    """Decode a base64url-encoded big-endian unsigned integer, as used for JWK n and e"""
+    return int.from_bytes(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)), 'big')
+
+@functools.lru_cache(maxsize=32)
+def _pubkey_from_jwk_json(jwk_json):
+    """RSA public key for a JWK given as canonical (sorted-keys) JSON, built once per distinct key"""
+    jwk = json.loads(jwk_json)
+    return RSAPublicNumbers(_b64url_uint(jwk['e']), _b64url_uint(jwk['n'])).public_key()
+
+# Algorithms accepted for local verification. The algorithm always comes from our side (the
+# option or the JWK), never from the token's own unverified header.
+_RSA_ALGORITHMS = ("RS256", "RS384", "RS512")
+
+def verify_token_locally(token, public_key, algorithm):
+    """Verify the token's signature and expiry against a trusted public key; returns the claims, or None"""
+    try:
+        claims = jwt.decode(token, public_key, algorithms=[algorithm], options={"verify_aud": False})
+    except jwt.ExpiredSignatureError:
+        print("❌ Signature is valid, but the token has expired")
+        return None
+    except jwt.PyJWTError as e:
+        print(f"❌ Token failed local verification: {e}")
+        return None
+    except (TypeError, ValueError) as e:
+        # PyJWT raises these when the key doesn't suit the algorithm
+        print(f"❌ The key can't verify this token: {e}")
+        return None
+
+    print("✅ Signature verified locally")
+    print(json.dumps(claims, indent=2))
+    return claims
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check whether a JWT's signing key is in its Descope project's JWKS")
+    parser.add_argument("--token", help="JWT to inspect (prompted for if omitted)")
+    parser.add_argument("--project-id", help="Descope project ID (prompted for if omitted)")
+    parser.add_argument(
+        "--pubkey-pem",
+        metavar="FILE",
+        help="trusted PEM public key; when given, the token is verified offline and the JWKS isn't fetched"
+    )
+    parser.add_argument(
+        "--alg",
+        choices=_RSA_ALGORITHMS,
+        default="RS256",
+        help="algorithm the --pubkey-pem key signs with (default: RS256)"
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
 
-def main():
     print("🔍 JWT Token Debug Tool")
     print("=" * 50)
     
     # Get token from user
-    token = input("Enter your JWT token: ").strip()
+    token = (args.token or input("Enter your JWT token: ")).strip()
     if not token:
         print("No token provided")
-        return
+        return EXIT_FAILED
     
     # Decode header to get key ID
     header = decode_jwt_header(token)
     if not header:
-        return
+        return EXIT_FAILED
     
     kid = header.get('kid')
-    if not kid:
+    if not kid and not args.pubkey_pem:
         print("❌ No 'kid' (key ID) found in JWT header")
-        return
+        return EXIT_FAILED
     
     print(f"🔑 Key ID from token: {kid}")
     print(f"📝 Algorithm: {header.get('alg')}")
     print(f"📝 Token type: {header.get('typ')}")
     
+    # With a trusted key at hand there is nothing to look up: verify the signature offline
+    if args.pubkey_pem:
+        try:
+            with open(args.pubkey_pem, 'rb') as f:
+                public_key = f.read()
+        except OSError as e:
+            print(f"❌ Could not read public key: {e}")
+            return EXIT_FAILED
+        print(f"\n🔐 Verifying token with {args.pubkey_pem}...")
+        claims = verify_token_locally(token, public_key, args.alg)
+        return EXIT_OK if claims is not None else EXIT_FAILED
+    
     # Get project ID from user
-    project_id = input("Enter your Descope Project ID: ").strip()
+    project_id = (args.project_id or input("Enter your Descope Project ID: ")).strip()
     if not project_id:
         print("No project ID provided")
-        return
+        return EXIT_FAILED
     
     # Construct JWKS URL
-    jwks_url = f"https://api.descope.com/{project_id}/.well-known/jwks.json"
+    jwks_url = JWKS_TMPL(project_id)
     print(f"🌐 JWKS URL: {jwks_url}")
     
     # Fetch JWKS
     print("\n📥 Fetching JWKS...")
-    jwks = fetch_jwks(jwks_url)
+    try:
+        jwks, from_cache = _fetch_jwks(jwks_url)
+        # A cached copy can predate a key rotation, so a kid it doesn't list is looked up live once
+        if from_cache and not any(key.get('kid') == kid for key in jwks.get('keys', ())):
+            print("🔄 Key ID not in the cached JWKS, refetching...")
+            jwks = fetch_jwks(jwks_url, refresh=True)
+    except socket.timeout:
+        return EXIT_TIMEOUT
     if not jwks:
-        return
+        return EXIT_FAILED
     
     # Check if key exists
     print(f"\n🔍 Checking if key '{kid}' exists in JWKS...")
-    key_exists = check_key_in_jwks(jwks, kid)
+    key = check_key_in_jwks(jwks, kid)
     
-    if not key_exists:
+    if key is None:
         print("\n💡 Troubleshooting suggestions:")
         print("1. Verify your Project ID is correct")
         print("2. Make sure the token is from the same Descope project")
         print("3. Check if the token is expired")
         print("4. Ensure you're using the correct environment (dev/staging/prod)")
-    else:
-        print("\n✅ The key exists in JWKS. The issue might be:")
-        print("1. Token expiration")
-        print("2. Incorrect audience or issuer")
-        print("3. Token format issues")
+        return EXIT_FAILED
+
+    # The key is known, so the signature and expiry can be checked right here. The algorithm
+    # comes from the JWK rather than the token's header.
+    algorithm = key.get('alg') or 'RS256'
+    if key.get('kty') == 'RSA' and algorithm in _RSA_ALGORITHMS and 'n' in key and 'e' in key:
+        print("\n🔐 Verifying token with the JWKS key...")
+        try:
+            public_key = _pubkey_from_jwk_json(json.dumps(key, sort_keys=True))
+        except (TypeError, ValueError) as e:
+            print(f"❌ The JWKS key for '{kid}' is malformed: {e}")
+            return EXIT_FAILED
+        if verify_token_locally(token, public_key, algorithm) is None:
+            return EXIT_FAILED
+        print("\n✅ The key exists in JWKS and the signature is valid. The issue might be:")
+        print("1. Incorrect audience or issuer")
+        print("2. Missing scopes for the route")
+        return EXIT_OK
+
+    print("\n✅ The key exists in JWKS. The issue might be:")
+    print("1. Token expiration")
+    print("2. Incorrect audience or issuer")
+    print("3. Token format issues")
+    return EXIT_OK
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
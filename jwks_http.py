@@ -0,0 +1,47 @@
+"""
+HTTP and JWKS helpers shared by setup_env.py and debug_token.py
+"""
+import json
+import socket
+import urllib.error
+import urllib.request
+
+# orjson parses the JWKS faster, but these scripts don't require it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JWKS URL for a project ID
+JWKS_TMPL = "https://api.descope.com/{}/.well-known/jwks.json".format
+
+# Same User-Agent as the app's JWKS client; Descope's edge may reject urllib's default one
+USER_AGENT = "Mozilla/5.0 (DescopeFastAPISampleApp)"
+
+# Seconds each socket operation (connect, read) of a request may take
+TIMEOUT = 10
+
+# Exit codes, so scripts can tell a network timeout from a failed setup or check
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_TIMEOUT = 2
+
+def loads_json(content):
+    """Parse JSON bytes with orjson when it is installed"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def http_get(url, headers=None):
+    """GET a URL with urllib; returns (status, headers, body), including for error statuses such as 304.
+    Raises socket.timeout if the server doesn't answer in time."""
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT, **(headers or {})})
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        with e:
+            return e.code, e.headers, e.read()
+    except urllib.error.URLError as e:
+        # A connect timeout arrives wrapped in URLError; surface it like a read timeout
+        if isinstance(e.reason, socket.timeout):
+            raise e.reason
+        raise
@@ -2,24 +2,35 @@
 """
 Setup script to configure environment variables for Descope FastAPI app
 """
+import argparse
+import asyncio
 import os
+import socket
 import sys
 
-def create_env_file():
-    """Create a .env file with the required environment variables"""
+from jwks_http import EXIT_FAILED, EXIT_OK, EXIT_TIMEOUT, JWKS_TMPL, http_get, loads_json
+
+def create_env_file(project_id=None, client_id=None, client_secret=None):
+    """Create a .env file with the required environment variables; returns the project ID, or None on failure"""
     
     print("🔧 Descope FastAPI Environment Setup")
     print("=" * 50)
     
+    # Values not passed in are asked for; once a project ID is passed in, nothing is prompted
+    interactive = project_id is None
+
     # Get project ID from user
-    project_id = input("Enter your Descope Project ID: ").strip()
+    if interactive:
+        project_id = input("Enter your Descope Project ID: ").strip()
     if not project_id:
         print("❌ Project ID is required")
-        return False
+        return None
     
     # Get client ID and secret (optional for basic setup)
-    client_id = input("Enter your Descope Inbound App Client ID (optional): ").strip()
-    client_secret = input("Enter your Descope Inbound App Client Secret (optional): ").strip()
+    if client_id is None:
+        client_id = input("Enter your Descope Inbound App Client ID (optional): ").strip() if interactive else ""
+    if client_secret is None:
+        client_secret = input("Enter your Descope Inbound App Client Secret (optional): ").strip() if interactive else ""
     
     # Create .env content
     env_content = f"""# Descope Configuration
@@ -28,63 +39,110 @@ DESCOPE_INBOUND_APP_CLIENT_ID={client_id or 'dummy-client-id'}
 DESCOPE_INBOUND_APP_CLIENT_SECRET={client_secret or 'dummy-client-secret'}
 """
     
-    # Write to .env file
+    # Write to .env file in one write. It holds the client secret, so it is created readable
+    # by the owner only (and an existing file is tightened to match, where supported).
     try:
-        with open('.env', 'w') as f:
-            f.write(env_content)
+        fd = os.open('.env', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            if hasattr(os, 'fchmod'):
+                os.fchmod(fd, 0o600)
+            os.write(fd, env_content.encode('utf-8'))
+        finally:
+            os.close(fd)
         print("✅ .env file created successfully!")
         print(f"📁 Project ID: {project_id}")
         if client_id:
             print(f"🔑 Client ID: {client_id}")
         else:
             print("⚠️  Client ID not set - OAuth features will be limited")
-        return True
+        return project_id
     except Exception as e:
         print(f"❌ Error creating .env file: {e}")
-        return False
+        return None
 
 def verify_jwks_url(project_id):
-    """Verify that the JWKS URL is accessible"""
-    import requests
-    
-    jwks_url = f"https://api.descope.com/{project_id}/.well-known/jwks.json"
+    """Verify that the JWKS URL is accessible; raises socket.timeout if the server doesn't answer in time"""
+    jwks_url = JWKS_TMPL(project_id)
     print(f"\n🔍 Verifying JWKS URL: {jwks_url}")
     
     try:
-        response = requests.get(jwks_url)
-        if response.status_code == 200:
-            jwks = response.json()
-            key_count = len(jwks.get('keys', []))
-            print(f"✅ JWKS URL is accessible")
-            print(f"📊 Found {key_count} signing keys")
-            return True
-        else:
-            print(f"❌ JWKS URL returned status code: {response.status_code}")
+        status, _, content = http_get(jwks_url)
+        if status != 200:
+            print(f"❌ JWKS URL returned status code: {status}")
             return False
+        jwks = loads_json(content)
+        key_count = len(jwks.get('keys', []))
+        print(f"✅ JWKS URL is accessible")
+        print(f"📊 Found {key_count} signing keys")
+        return True
+    except socket.timeout:
+        print(f"❌ Timed out accessing JWKS URL: {jwks_url}")
+        raise
     except Exception as e:
         print(f"❌ Error accessing JWKS URL: {e}")
         return False
 
-def main():
-    if create_env_file():
-        # Get project ID from the file we just created
-        with open('.env', 'r') as f:
-            for line in f:
-                if line.startswith('DESCOPE_PROJECT_ID='):
-                    project_id = line.split('=')[1].strip()
-                    break
-        
-        print("\n🔍 Verifying configuration...")
-        if verify_jwks_url(project_id):
-            print("\n✅ Setup completed successfully!")
-            print("\n🚀 Next steps:")
-            print("1. Start the server: uvicorn app.main:app --reload")
-            print("2. Test the public endpoint: http://localhost:8000/api/public")
-            print("3. Get a valid token from your Descope project")
-            print("4. Test protected endpoints with the token")
-        else:
-            print("\n⚠️  Setup completed but JWKS verification failed.")
-            print("Please check your Project ID and try again.")
+def verify_jwks_urls(project_ids):
+    """Verify the JWKS URLs of several projects concurrently; returns {project_id: accessible}"""
+    async def verify_all():
+        # urllib is blocking, so each check runs in its own worker thread. A timeout on one
+        # project counts as inaccessible rather than aborting the others.
+        results = await asyncio.gather(
+            *(asyncio.to_thread(verify_jwks_url, project_id) for project_id in project_ids),
+            return_exceptions=True
+        )
+        return {project_id: result is True for project_id, result in zip(project_ids, results)}
+
+    return asyncio.run(verify_all())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Create the .env file for the Descope FastAPI app and verify its JWKS URL")
+    parser.add_argument("--project-id", help="Descope project ID (prompted for if omitted)")
+    parser.add_argument("--client-id", help="Descope Inbound App client ID")
+    parser.add_argument(
+        "--client-secret",
+        default=os.environ.get("DESCOPE_INBOUND_APP_CLIENT_SECRET"),
+        help="Descope Inbound App client secret (defaults to $DESCOPE_INBOUND_APP_CLIENT_SECRET, which keeps it out of the process list)"
+    )
+    parser.add_argument(
+        "--verify",
+        nargs="+",
+        metavar="PROJECT_ID",
+        help="only check the JWKS URLs of these projects, concurrently, without writing .env"
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.verify:
+        results = verify_jwks_urls(args.verify)
+        return EXIT_OK if all(results.values()) else EXIT_FAILED
+
+    project_id = create_env_file(args.project_id, args.client_id, args.client_secret)
+    if not project_id:
+        return EXIT_FAILED
+
+    print("\n🔍 Verifying configuration...")
+    try:
+        verified = verify_jwks_url(project_id)
+    except socket.timeout:
+        print("\n⚠️  Setup completed but the JWKS URL timed out.")
+        print("Please check your network connection and try again.")
+        return EXIT_TIMEOUT
+
+    if verified:
+        print("\n✅ Setup completed successfully!")
+        print("\n🚀 Next steps:")
+        print("1. Start the server: uvicorn app.main:app --reload")
+        print("2. Test the public endpoint: http://localhost:8000/api/public")
+        print("3. Get a valid token from your Descope project")
+        print("4. Test protected endpoints with the token")
+        return EXIT_OK
+
+    print("\n⚠️  Setup completed but JWKS verification failed.")
+    print("Please check your Project ID and try again.")
+    return EXIT_FAILED
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file